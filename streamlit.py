@@ -6,20 +6,158 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import io
+import bisect
 import boto3
-import altair as alt
+from botocore.config import Config
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import tempfile
+import hashlib
 from datetime import datetime
+from pathlib import Path
+
+def normalize_column_name(name):
+    return name.lower().replace(' ', '').replace('_', '')
+
+def build_column_lookup(column_list):
+    # Normalized name -> first matching column, built once per dataset so each
+    # factor lookup is a dict hit instead of a scan over every column.
+    column_lookup = {}
+    for col in column_list:
+        column_lookup.setdefault(normalize_column_name(col), col)
+    return column_lookup
+
+def clean_column_name(name):
+    return name.replace(' Harmonized', ' (cleaned)').replace('_harmonized', ' (cleaned)')
+
+def clean_feature_name(name):
+    return name.removeprefix('SHAP-').replace(' Harmonized', ' (cleaned)')
+
+def select_used_columns(column_names, feature_table):
+    # Keep the dashboard's own columns plus every raw column a factor name refers to,
+    # so the detail panel can still show the pet's actual value for that factor.
+    referenced = {
+        normalize_column_name(clean_feature_name(name))
+        for col in FEATURE_COLUMNS if col in feature_table.column_names
+        for name in feature_table.column(col).unique().to_pylist() if isinstance(name, str)
+    }
+    return [
+        col for col in column_names
+        if normalize_column_name(col) in USED_COLUMNS_NORMALIZED
+        or normalize_column_name(clean_column_name(col)) in referenced
+    ]
+
+@st.cache_resource
+def get_s3_client():
+    return boto3.client(
+        's3',
+        aws_access_key_id=st.secrets.aws.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=st.secrets.aws.AWS_SECRET_ACCESS_KEY,
+        region_name=st.secrets.aws.AWS_REGION,
+        config=Config(tcp_keepalive=True)
+    )
+
+def read_s3_object(s3, bucket, key):
+    obj = s3.get_object(Bucket=bucket, Key=key)
+    # Pull the whole object in a single read() rather than letting the parser
+    # pull small chunks from the StreamingBody over the network.
+    body = io.BytesIO(obj['Body'].read())
+    if key.endswith('.parquet'):
+        # Both formats project just the columns the dashboard reads; the factor-name
+        # columns are read first because they decide which value columns that is.
+        parquet_file = pq.ParquetFile(body)
+        column_names = parquet_file.schema_arrow.names
+        feature_table = parquet_file.read(columns=[col for col in column_names if col in FEATURE_COLUMNS])
+        df = parquet_file.read(columns=select_used_columns(column_names, feature_table)).to_pandas()
+    else:
+        # Parse once into Arrow (which also strips a BOM) and convert only the
+        # projected columns to pandas.
+        table = pa_csv.read_csv(body, convert_options=pa_csv.ConvertOptions(strings_can_be_null=True))
+        df = table.select(select_used_columns(table.column_names, table)).to_pandas()
+    # Parquet sources already carry a datetime column; only parse CSV strings.
+    if 'intake_date' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['intake_date']):
+        df['intake_date'] = pd.to_datetime(df['intake_date'], format='ISO8601', errors='coerce', cache=True)
+    df['predicted_proba'] = pd.to_numeric(df['predicted_proba'], downcast='float')
+    for col in df.select_dtypes('float64').columns:
+        df[col] = df[col].astype('float32')
+    df['non_adopted_label'] = pd.to_numeric(df['non_adopted_label'], downcast='unsigned')
+    df['stay_length_days'] = pd.to_numeric(df['stay_length_days'], downcast='integer')
+    return df
+
+def read_local_copy(local_path):
+    # A corrupt or unreadable copy is dropped, so the caller downloads again instead
+    # of failing every load until someone clears the temp directory.
+    if not local_path.exists():
+        return None
+    try:
+        return pd.read_parquet(local_path)
+    except (OSError, ValueError):
+        local_path.unlink(missing_ok=True)
+        return None
+
+def save_local_copy(df, local_path):
+    # Best effort: a failed write only means the next cold start downloads again.
+    tmp_path = None
+    try:
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+        # Each writer gets its own temp file, so concurrent processes never share one.
+        with tempfile.NamedTemporaryFile(dir=local_path.parent, suffix='.tmp', delete=False) as tmp_file:
+            tmp_path = Path(tmp_file.name)
+            df.to_parquet(tmp_file, compression='zstd')
+        tmp_path.replace(local_path)
+        # Copies for older ETags or loader versions are never read again.
+        for stale_path in local_path.parent.glob('*.parquet'):
+            if stale_path != local_path:
+                stale_path.unlink(missing_ok=True)
+    except (OSError, ValueError, TypeError):
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
+
+def prepare_data(df):
+    # Runs inside the cached loader, so this only happens once per loaded object.
+    df.columns = [clean_column_name(col) for col in df.columns]
+
+    # Feature-name columns hold only a handful of distinct values, so clean each
+    # distinct name once and map it back instead of running string ops per row.
+    clean_feature_names = {
+        name: clean_feature_name(name)
+        for name in pd.unique(df[FEATURE_COLUMNS].to_numpy().ravel()) if isinstance(name, str)
+    }
+    for col in FEATURE_COLUMNS:
+        df[col] = df[col].map(clean_feature_names).astype('category')
+    df['animal_type'] = df['animal_type'].astype('category')
+    df['Primary Concern'] = pd.Categorical(np.where(df['predicted_proba'] < 0.5, df['Negative_Feature_1'], df['Positive_Feature_1']))
+    # searchsorted gives the category code directly: 0 below 25%, 1 below 50%, else 2.
+    risk_codes = np.searchsorted(RISK_THRESHOLDS, df['predicted_proba'].to_numpy(), side='right')
+    df['adoptability_category'] = pd.Categorical.from_codes(risk_codes, categories=RISK_CATEGORIES)
+
+    team_map = { 2: "Community Outreach", 1: "Rescue Coordinator", 0: "Foster Coordinator" }
+    
+    df['recommended_team'] = df['non_adopted_label'].map(team_map).astype('category')
+
+    # Sort once here; boolean filtering keeps this order, so reruns never re-sort.
+    return df.sort_values('predicted_proba', ascending=True, kind='stable').reset_index(drop=True)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def fetch_data_from_s3(bucket, key):
+    # Exceptions are not cached, so a failed fetch is retried on the next rerun.
+    s3 = get_s3_client()
+    # A local Parquet copy keyed by the object's ETag and the loader version lets a
+    # restarted process skip the download and CSV parse while neither has changed.
+    etag = s3.head_object(Bucket=bucket, Key=key)['ETag'].strip('"')
+    local_path = LOCAL_CACHE_DIR / f"{etag}-{LOCAL_CACHE_VERSION}.parquet"
+    df = read_local_copy(local_path)
+    if df is None:
+        df = read_s3_object(s3, bucket, key)
+        save_local_copy(df, local_path)
+    df = prepare_data(df)
+    # Lets downstream caches key on the object version instead of hashing the frame.
+    df.attrs['etag'] = etag
+    return df
 
 def load_data_from_s3(bucket, key):
     try:
-        s3 = boto3.client(
-            's3',
-            aws_access_key_id=st.secrets.aws.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=st.secrets.aws.AWS_SECRET_ACCESS_KEY,
-            region_name=st.secrets.aws.AWS_REGION
-        )
-        obj = s3.get_object(Bucket=bucket, Key=key)
-        return pd.read_csv(obj['Body'])
+        return fetch_data_from_s3(bucket, key)
     except Exception as e:
         st.error(f"Error loading data from S3: {e}")
         return None
@@ -27,6 +165,23 @@ def load_data_from_s3(bucket, key):
 # --- Configuration ---
 S3_BUCKET_NAME = "xgb-los-multi"
 FILE_KEY = "lz-multiclass/final_pipeline_prediction.csv"
+LOCAL_CACHE_DIR = Path(tempfile.gettempdir()) / "petadoption"
+
+RISK_THRESHOLDS = [0.25, 0.50]
+RISK_CATEGORIES = ["High Risk", "Medium Risk", "Low Risk"]
+
+# Columns the dashboard reads; the loader also keeps the raw column behind each
+# distinct SHAP feature name found in FEATURE_COLUMNS.
+FEATURE_COLUMNS = [f'{side}_Feature_{i}' for side in ('Positive', 'Negative') for i in range(1, 4)]
+USED_COLUMNS = [
+    'animal_id', 'animal_type', 'predicted_proba', 'non_adopted_label', 'stay_length_days', 'intake_date'
+] + FEATURE_COLUMNS
+USED_COLUMNS_NORMALIZED = {normalize_column_name(col) for col in USED_COLUMNS}
+
+# The local copy stores read_s3_object's output, so its name carries the loader
+# version: bump LOCAL_CACHE_FORMAT whenever the columns or dtypes it returns change.
+LOCAL_CACHE_FORMAT = 2
+LOCAL_CACHE_VERSION = hashlib.sha1(repr((LOCAL_CACHE_FORMAT, sorted(USED_COLUMNS_NORMALIZED))).encode()).hexdigest()[:10]
 
 df = load_data_from_s3(S3_BUCKET_NAME, FILE_KEY)
 
@@ -37,19 +192,7 @@ if df is not None:
     if 'selected_animal_id' not in st.session_state:
         st.session_state.selected_animal_id = None
 
-    df.columns = [col.replace(' Harmonized', ' (cleaned)').replace('_harmonized', ' (cleaned)') for col in df.columns]
-
-    for i in range(1, 4):
-        df[f'Positive_Feature_{i}'] = df[f'Positive_Feature_{i}'].str.replace(' Harmonized', ' (cleaned)', regex=False)
-        df[f'Negative_Feature_{i}'] = df[f'Negative_Feature_{i}'].str.replace(' Harmonized', ' (cleaned)', regex=False)
-
-    team_map = { 2: "Community Outreach", 1: "Rescue Coordinator", 0: "Foster Coordinator" }
-    
-    df['recommended_team'] = df['non_adopted_label'].map(team_map)
-
-    for i in range(1, 4):
-        df[f'Positive_Feature_{i}'] = df[f'Positive_Feature_{i}'].str.replace('SHAP-', '', regex=False)
-        df[f'Negative_Feature_{i}'] = df[f'Negative_Feature_{i}'].str.replace('SHAP-', '', regex=False)
+    column_lookup = build_column_lookup(df.columns)
 
 EMOJI_MAP = {
     "Age Months": "🎂", "Is Mix": "🧬", "Intake Type Harmonized": "🏷️",
@@ -64,38 +207,111 @@ INTAKE_TYPE_MAP = {
     "OWNER SUR": "an owner surrender"
 }
 
-def find_closest_column_name(name_to_find, column_list):
-    if pd.isna(name_to_find): return None
-    normalized_target = name_to_find.lower().replace(' ', '').replace('_', '')
-    for col in column_list:
-        normalized_col = col.lower().replace(' ', '').replace('_', '')
-        if normalized_target == normalized_col:
-            return col
-    return name_to_find
-
-def generate_full_dashboard_html(pet_data):
-    predicted_proba = pet_data.get('predicted_proba', 0)
-    formatted_proba = f"{(predicted_proba * 100):.2f}%"
+# Vega-Lite specs for the summary charts, written as plain dicts so reruns skip
+# building and serialising Altair chart objects.
+CATEGORY_CHART_SPEC = {
+    "mark": "bar",
+    "height": 200,
+    "encoding": {
+        "x": {"field": "count", "type": "quantitative", "title": "Number of Pets"},
+        "y": {"field": "adoptability_category", "type": "nominal", "title": "Category", "sort": ["Low Risk", "Medium Risk", "High Risk"]},
+        "color": {
+            "field": "adoptability_category", "type": "nominal", "legend": None,
+            "scale": {"domain": ["High Risk", "Medium Risk", "Low Risk"], "range": ["#FF6B6B", "#FFD166", "#06D6A0"]}
+        }
+    }
+}
+
+PROBA_HIST_SPEC = {
+    "mark": "bar",
+    "height": 250,
+    "encoding": {
+        "x": {"field": "bin_start", "type": "quantitative", "title": "Adoption Probability", "axis": {"format": "%"}},
+        "x2": {"field": "bin_end"},
+        "y": {"field": "count", "type": "quantitative", "title": "Number of Pets"}
+    }
+}
+
+RISK_CELL_STYLES = np.array([
+    'background-color: #FF6B6B; color: white',
+    'background-color: #FFD166',
+    'background-color: #06D6A0; color: white'
+])
+
+RISK_PROGRESS_COLORS = ("bg-red-500", "bg-yellow-500", "bg-green-500")
+
+RISK_BADGES = {
+    "High Risk": "🔴 High Risk",
+    "Medium Risk": "🟡 Medium Risk",
+    "Low Risk": "🟢 Low Risk"
+}
+
+# Dashboard styles, scoped under .petdash-root so the same rules work inside the
+# standalone iframe and when the panel is embedded directly in the Streamlit page.
+# The utility classes are the handful of Tailwind classes the page uses, prebuilt so
+# nothing loads and runs the Tailwind CDN compiler on every pet click.
+DASHBOARD_CSS = (
+    ".petdash-root{line-height:1.5;font-family:'Inter',sans-serif;}.petdash-root *,.petdash-root ::before,.petdash-root ::after{box-sizing:border-box;border:0 solid;}.petdash-root h1,.petdash-root h2,.petdash-root h3,.petdash-root p{margin:0;padding:0;font-size:inherit;font-weight:inherit;line-height:inherit;color:inherit;}"
+    ".petdash-root .flex{display:flex;}.petdash-root .flex-col{flex-direction:column;}.petdash-root .gap-4{gap:1rem;}.petdash-root .max-w-3xl{max-width:48rem;}.petdash-root .mx-auto{margin-left:auto;margin-right:auto;}.petdash-root .p-4{padding:1rem;}.petdash-root .px-3{padding-left:0.75rem;padding-right:0.75rem;}.petdash-root .py-0\\.5{padding-top:0.125rem;padding-bottom:0.125rem;}.petdash-root .mb-2{margin-bottom:0.5rem;}.petdash-root .mb-3{margin-bottom:0.75rem;}.petdash-root .mt-1{margin-top:0.25rem;}.petdash-root .mt-3{margin-top:0.75rem;}.petdash-root .space-y-2>*+*{margin-top:0.5rem;}"
+    ".petdash-root .rounded-lg{border-radius:0.5rem;}.petdash-root .rounded-full{border-radius:9999px;}.petdash-root .shadow-sm{box-shadow:0 1px 2px 0 rgba(0,0,0,0.05);}.petdash-root .bg-white{background-color:#fff;}.petdash-root .bg-gray-50{background-color:#f9fafb;}.petdash-root .bg-red-500{background-color:#ef4444;}.petdash-root .bg-yellow-500{background-color:#eab308;}.petdash-root .bg-green-500{background-color:#22c55e;}"
+    ".petdash-root .text-sm{font-size:0.875rem;line-height:1.25rem;}.petdash-root .text-lg{font-size:1.125rem;line-height:1.75rem;}.petdash-root .text-2xl{font-size:1.5rem;line-height:2rem;}.petdash-root .font-medium{font-weight:500;}.petdash-root .font-bold{font-weight:700;}.petdash-root .text-white{color:#fff;}.petdash-root .text-gray-500{color:#6b7280;}.petdash-root .text-gray-700{color:#374151;}.petdash-root .text-gray-800{color:#1f2937;}"
+    "@media (min-width:640px){.petdash-root .sm\\:p-6{padding:1.5rem;}}"
+    ".petdash-root .module{padding:1rem;}.petdash-root .progress-bar{height:8px;border-radius:4px;background-color:#e9ecef;}.petdash-root .progress-fill{height:100%;border-radius:4px;}.petdash-root .team-section{background-color:#f8fafc;border-radius:0.5rem;padding:1rem;box-shadow:0 1px 2px 0 rgba(0,0,0,0.05);}.petdash-root .team-header{display:flex;align-items:center;gap:0.75rem;}"
+    ".petdash-root .team-avatar{background-color:#e0f2fe;padding:0.75rem;border-radius:9999px;}.petdash-root .team-avatar span{line-height:1;}.petdash-root .team-info h3{font-weight:600;font-size:0.875rem;line-height:1.25rem;}.petdash-root .team-info .team-title{font-size:0.75rem;line-height:1rem;color:#64748b;}"
+)
+
+# Single-line body so st.markdown treats it as one raw HTML block.
+DASHBOARD_BODY_TEMPLATE = (
+    '<div class="petdash-root"><div class="bg-white p-4 sm:p-6"><div class="mb-3"><h1 class="text-2xl font-bold text-gray-800">Pet Adoptability Dashboard</h1><p class="text-sm text-gray-500">Pet ID: #{animal_id}</p></div>'
+    '<div class="flex flex-col gap-4 max-w-3xl mx-auto"><div class="bg-gray-50 rounded-lg p-4 shadow-sm module"><h2 class="text-lg font-bold text-gray-700 mb-2">Adoption Probability</h2><h3 class="font-bold text-gray-700">Probability: {formatted_proba}</h3><div class="progress-bar mt-1"><div class="progress-fill {progress_color}" style="width:{progress_bar_width}%"></div></div><div class="mt-3"><span class="{progress_color} text-white px-3 py-0.5 rounded-full text-sm font-medium">{risk_category}</span></div></div>'
+    '{team_html_module}<div class="bg-gray-50 rounded-lg p-4 shadow-sm module"><h2 class="text-lg font-bold text-gray-700 mb-2">{factors_title}</h2><div class="space-y-2">{factors_html}</div></div></div></div></div>'
+)
+
+DASHBOARD_HTML_HEAD = '<!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><style>body{margin:0;}' + DASHBOARD_CSS + '</style></head><body>'
+DASHBOARD_HTML_TAIL = '</body></html>'
+
+TEAM_HTML_TEMPLATE = '<div class="team-section"><div class="team-header"><div class="team-avatar"><span>🤝</span></div><div class="team-info"><h3>{recommended_team}</h3><div class="team-title">Recommended Team</div></div></div></div>'
+
+def find_closest_column_name(name_to_find, column_lookup):
+    if not isinstance(name_to_find, str): return None
+    return column_lookup.get(normalize_column_name(name_to_find), name_to_find)
+
+def generate_full_dashboard_html(pet_data, column_lookup, embedded=False):
+    # Reduce the row to the few primitives the page depends on, so the rendered
+    # HTML can be cached per pet instead of hashing the whole Series.
+    predicted_proba = float(pet_data.get('predicted_proba', 0) or 0.0)
+    feature_prefix = "Negative_Feature_" if predicted_proba < 0.5 else "Positive_Feature_"
+
+    factors = []
+    factor_names = pet_data.reindex([f'{feature_prefix}{i}' for i in range(1, 4)]).to_numpy()
+    for factor_name in factor_names:
+        # Feature-name cells are either a string or a missing-value float.
+        if not isinstance(factor_name, str) or not factor_name: continue
+
+        factor_name = factor_name.strip()
+        corrected_column_name = find_closest_column_name(factor_name, column_lookup)
+        factors.append((factor_name, pet_data.get(corrected_column_name, '[N/A]')))
+
+    return render_dashboard_html(
+        pet_data.get('animal_id', 'N/A'),
+        predicted_proba,
+        pet_data.get('recommended_team', 'N/A'),
+        tuple(factors),
+        embedded
+    )
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def render_dashboard_html(animal_id, predicted_proba, recommended_team, factors, embedded=False):
     progress_bar_width = predicted_proba * 100
-    animal_id = pet_data.get('animal_id', 'N/A')
-    recommended_team = pet_data.get('recommended_team', 'N/A')
-    
+    formatted_proba = f"{progress_bar_width:.2f}%"
+
     factor_phrases = []
     if predicted_proba < 0.5:
-        feature_prefix = "Negative_Feature_"
         factors_title = "Top Factors Decreasing Adoption Probability"
     else:
-        feature_prefix = "Positive_Feature_"
         factors_title = "Top Factors Increasing Adoption Probability"
 
-    for i in range(1, 4):
-        factor_name = pet_data.get(f'{feature_prefix}{i}', '')
-        if not factor_name or pd.isna(factor_name): continue
-        
-        factor_name = factor_name.strip()
-        corrected_column_name = find_closest_column_name(factor_name, pet_data.keys())
-        actual_feature_value = pet_data.get(corrected_column_name, '[N/A]')
-        
+    for factor_name, actual_feature_value in factors:
         phrase = ""
         if factor_name == "Has Name":
             phrase = "having a name" if actual_feature_value == 1 else "not having a name"
@@ -145,28 +361,72 @@ def generate_full_dashboard_html(pet_data):
     
     factors_html = f'<div class="text-sm text-gray-800">{summary_sentence}</div>'
 
-    if pd.notna(recommended_team) and predicted_proba < 0.5:
-        team_html_module = f"""
-        <div class="team-section"><div class="team-header"><div class="team-avatar"><i class="fas fa-hands-helping"></i></div><div class="team-info"><h3>{recommended_team}</h3><div class="team-title">Recommended Team</div></div></div></div>"""
+    if isinstance(recommended_team, str) and predicted_proba < 0.5:
+        team_html_module = TEAM_HTML_TEMPLATE.format(recommended_team=recommended_team)
     else:
         team_html_module = ""
 
-    if predicted_proba < 0.25: progress_color, risk_category = "bg-red-500", "High Risk"
-    elif predicted_proba < 0.5: progress_color, risk_category = "bg-yellow-500", "Medium Risk"
-    else: progress_color, risk_category = "bg-green-500", "Low Risk"
-
-    return f"""
-    <!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><script src="https://cdn.tailwindcss.com"></script><link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
-    <style>body{{font-family:'Inter',sans-serif;}}.module{{padding:1rem;}}.progress-bar{{height:8px;border-radius:4px;background-color:#e9ecef;}}.progress-fill{{height:100%;border-radius:4px;}}.team-section{{background-color:#f8fafc;border-radius:0.5rem;padding:1rem;box-shadow:0 1px 2px 0 rgba(0,0,0,0.05);}}.team-header{{display:flex;align-items:center;gap:0.75rem;}}.team-avatar{{background-color:#e0f2fe;padding:0.75rem;border-radius:9999px;}}.team-avatar i{{color:#0ea5e9;}}.team-info h3{{font-weight:600;font-size:0.875rem;line-height:1.25rem;}}.team-info .team-title{{font-size:0.75rem;line-height:1rem;color:#64748b;}}</style></head>
-    <body><div class="bg-white p-4 sm:p-6"><div class="mb-3"><h1 class="text-2xl font-bold text-gray-800">Pet Adoptability Dashboard</h1><p class="text-sm text-gray-500">Pet ID: #{animal_id}</p></div>
-    <div class="flex flex-col gap-4 max-w-3xl mx-auto"><div class="bg-gray-50 rounded-lg p-4 shadow-sm module"><h2 class="text-lg font-bold text-gray-700 mb-2">Adoption Probability</h2><h3 class="font-bold text-gray-700">Probability: {formatted_proba}</h3><div class="progress-bar mt-1"><div class="progress-fill {progress_color}" style="width:{progress_bar_width}%"></div></div><div class="mt-3"><span class="{progress_color} text-white px-3 py-0.5 rounded-full text-sm font-medium">{risk_category}</span></div></div>
-    {team_html_module}<div class="bg-gray-50 rounded-lg p-4 shadow-sm module"><h2 class="text-lg font-bold text-gray-700 mb-2">{factors_title}</h2><div class="space-y-2">{factors_html}</div></div></div></div></body></html>
-    """
-
-def color_predicted_proba(val):
-    if val < 0.25: return 'background-color: #FF6B6B; color: white'
-    elif val < 0.50: return 'background-color: #FFD166'
-    else: return 'background-color: #06D6A0; color: white'
+    # Same bucketing as adoptability_category in the loader.
+    risk_index = bisect.bisect_right(RISK_THRESHOLDS, predicted_proba)
+    progress_color, risk_category = RISK_PROGRESS_COLORS[risk_index], RISK_CATEGORIES[risk_index]
+
+    dashboard_body = DASHBOARD_BODY_TEMPLATE.format_map({
+        'animal_id': animal_id,
+        'formatted_proba': formatted_proba,
+        'progress_color': progress_color,
+        'progress_bar_width': progress_bar_width,
+        'risk_category': risk_category,
+        'team_html_module': team_html_module,
+        'factors_title': factors_title,
+        'factors_html': factors_html,
+    })
+    if embedded:
+        return f'<style>{DASHBOARD_CSS}</style>{dashboard_body}'
+    return DASHBOARD_HTML_HEAD + dashboard_body + DASHBOARD_HTML_TAIL
+
+def color_predicted_proba(proba):
+    # Called once with the whole column by Styler.apply, not once per cell.
+    return RISK_CELL_STYLES[np.searchsorted(RISK_THRESHOLDS, proba.to_numpy(), side='right')]
+
+# Every stay-slider position is a new key, so cap the entries kept between TTL sweeps.
+@st.cache_data(ttl=600, max_entries=64, show_spinner=False)
+def filter_pets(_df, data_version, animal_types, stay_range, risk_categories):
+    # _df is not hashed by the cache; data_version (the S3 ETag) keys the data instead,
+    # so unchanged filters skip the mask on a rerun. _df is presorted by the loader.
+    # cache_data pickles what it returns, so this hands back row positions rather
+    # than a copy of the frame; None means every pet passes.
+    min_selected_stay, max_selected_stay = stay_range
+    # Plain NumPy masks skip pandas' index alignment on every &=.
+    stay_length_days = _df['stay_length_days'].to_numpy()
+    mask = (stay_length_days >= min_selected_stay) & (stay_length_days <= max_selected_stay)
+    if animal_types:
+        mask &= _df['animal_type'].isin(animal_types).to_numpy()
+    if risk_categories:
+        mask &= _df['adoptability_category'].isin(risk_categories).to_numpy()
+
+    return None if mask.all() else np.flatnonzero(mask)
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def get_pet_positions(_df, data_version):
+    # Built once per data version: the ids in sorted order plus the row position of
+    # each, so a lookup is a binary search. cache_resource hands back the same arrays
+    # instead of unpickling them on each rerun; a stable sort keeps duplicate ids in
+    # row order.
+    pet_ids = _df['animal_id'].to_numpy()
+    order = np.argsort(pet_ids, kind='stable')
+    return pet_ids[order], order
+
+def find_shown_position(pet_positions, pet_id, shown_positions):
+    # Position within the shown frame of the first row for pet_id, or None if no row
+    # for it passes the filters. Both steps are binary searches over sorted arrays.
+    sorted_ids, order = pet_positions
+    rows = order[np.searchsorted(sorted_ids, pet_id, side='left'):np.searchsorted(sorted_ids, pet_id, side='right')]
+    if shown_positions is None:
+        return rows[0] if len(rows) else None
+    slots = np.searchsorted(shown_positions, rows)
+    shown = slots < len(shown_positions)
+    shown[shown] = shown_positions[slots[shown]] == rows[shown]
+    return slots[shown][0] if shown.any() else None
 
 # --- 2. MAIN APP WORKFLOW ---
 st.title("🐾 Shelter Pet Priority Board")
@@ -174,19 +434,10 @@ st.write("This board automatically surfaces the pets that need the most attentio
 st.markdown("<p style='color: red;'>**Note: 'High Risk' means a pet is at a high risk of NOT being adopted**</p>", unsafe_allow_html=True)
 
 if df is not None:
-    def get_adoptability_category(predicted_proba):
-        if predicted_proba < 0.25: return "High Risk"
-        if predicted_proba < 0.50: return "Medium Risk"
-        return "Low Risk"
-    df['adoptability_category'] = df['predicted_proba'].apply(get_adoptability_category)
-
     st.sidebar.header("Filter Options")
-    if 'intake_date' in df.columns:
-        df['intake_date'] = pd.to_datetime(df['intake_date'], errors='coerce')
-    
-    filtered_df = df.copy()
 
-    animal_types = sorted(df['animal_type'].dropna().unique())
+    # astype('category') in the loader already stores the distinct types sorted.
+    animal_types = df['animal_type'].cat.categories.tolist()
     selected_animal_types = st.sidebar.multiselect('Filter by Animal Type:', options=animal_types, default=animal_types)
 
     min_stay = int(df['stay_length_days'].min())
@@ -198,81 +449,90 @@ if df is not None:
         value=(min_stay, max_stay)
     )
     
-    risk_categories = ["High Risk", "Medium Risk", "Low Risk"]
+    risk_categories = RISK_CATEGORIES
     selected_risk_categories = st.sidebar.multiselect(
         'Filter by Risk Category:',
         options=risk_categories,
         default=risk_categories
     )
 
-    if selected_animal_types:
-        filtered_df = filtered_df[filtered_df['animal_type'].isin(selected_animal_types)]
-    
-    min_selected_stay, max_selected_stay = stay_range
-    filtered_df = filtered_df[
-        (filtered_df['stay_length_days'] >= min_selected_stay) &
-        (filtered_df['stay_length_days'] <= max_selected_stay)
-    ]
-    
-    if selected_risk_categories:
-        filtered_df = filtered_df[filtered_df['adoptability_category'].isin(selected_risk_categories)]
+    st.sidebar.header("Display Options")
+    render_details_in_iframe = st.sidebar.checkbox(
+        'Render pet details in an iframe',
+        value=False,
+        help="Use this if the details panel picks up styles from the rest of the app."
+    )
+
+    # Multiselect values are a subset of the options, so a full selection is a no-op
+    # and is passed as an empty tuple; sorting keeps the cache key order-independent.
+    animal_type_filter = ()
+    if selected_animal_types and len(selected_animal_types) < len(animal_types):
+        animal_type_filter = tuple(sorted(selected_animal_types))
+    risk_category_filter = ()
+    if selected_risk_categories and len(selected_risk_categories) < len(risk_categories):
+        risk_category_filter = tuple(sorted(selected_risk_categories))
+
+    shown_positions = filter_pets(df, df.attrs.get('etag'), animal_type_filter, stay_range, risk_category_filter)
+    # The default sidebar state keeps every pet, so skip the take then.
+    sorted_df = df if shown_positions is None else df.take(shown_positions)
 
     with st.expander("Show Shelter-Wide Summary Dashboard", expanded=True):
+        # Aggregate in pandas so Vega-Lite receives a few summary rows rather than every pet.
         st.subheader("Pets by Adoptability")
-        category_chart = alt.Chart(filtered_df).mark_bar().encode(
-            x=alt.X('count():Q', title="Number of Pets"),
-            y=alt.Y('adoptability_category:N', title="Category", sort=['Low Risk', 'Medium Risk', 'High Risk']),
-            color=alt.Color('adoptability_category:N', scale=alt.Scale(domain=['High Risk', 'Medium Risk', 'Low Risk'], range=['#FF6B6B', '#FFD166', '#06D6A0']), legend=None)
-        ).properties(height=200)
-        st.altair_chart(category_chart, use_container_width=True)
+        category_counts = sorted_df['adoptability_category'].value_counts().rename_axis('adoptability_category').reset_index(name='count')
+        st.vega_lite_chart(category_counts, CATEGORY_CHART_SPEC, use_container_width=True)
         st.subheader("Distribution of Adoption Probability")
-        predicted_proba_hist = alt.Chart(filtered_df).mark_bar().encode(
-            # --- CHANGE: Added axis formatting to show percentages ---
-            alt.X("predicted_proba:Q", 
-                  bin=alt.Bin(maxbins=20), 
-                  title="Adoption Probability",
-                  axis=alt.Axis(format='%')),
-            alt.Y('count():Q', title="Number of Pets"),
-        ).properties(height=250)
-        st.altair_chart(predicted_proba_hist, use_container_width=True)
-
-    sorted_df = filtered_df.sort_values(by="predicted_proba", ascending=True)
+        hist_counts, hist_edges = np.histogram(sorted_df['predicted_proba'].to_numpy(), bins=20, range=(0, 1))
+        hist_df = pd.DataFrame({'bin_start': hist_edges[:-1], 'bin_end': hist_edges[1:], 'count': hist_counts})
+        st.vega_lite_chart(hist_df, PROBA_HIST_SPEC, use_container_width=True)
+
     col1, col2 = st.columns([1, 1.2])
     with col1:
         st.header("Triage List")
-        st.markdown("""<style>.legend-item{display:flex;align-items:center;margin-bottom:5px;}.legend-color{width:15px;height:15px;margin-right:8px;border-radius:3px;}</style><b>Adoption Probability Legend:</b>""", unsafe_allow_html=True)
+        # Matches the badges in the table's Risk column.
+        st.markdown("**Adoption Probability Legend:**")
         leg1, leg2, leg3 = st.columns(3)
-        with leg1: st.markdown("<div class='legend-item'><div class='legend-color' style='background-color:#FF6B6B;'></div> High Risk (< 25%)</div>", unsafe_allow_html=True)
-        with leg2: st.markdown("<div class='legend-item'><div class='legend-color' style='background-color:#FFD166;'></div> Medium Risk (25-50%)</div>", unsafe_allow_html=True)
-        with leg3: st.markdown("<div class='legend-item'><div class='legend-color' style='background-color:#06D6A0;'></div> Low Risk (≥ 50%)</div>", unsafe_allow_html=True)
+        with leg1: st.markdown(f"{RISK_BADGES['High Risk']} (< 25%)")
+        with leg2: st.markdown(f"{RISK_BADGES['Medium Risk']} (25-50%)")
+        with leg3: st.markdown(f"{RISK_BADGES['Low Risk']} (≥ 50%)")
         st.write("Click on a row to view pet details")
-        sorted_df['Primary Concern'] = np.where(sorted_df['predicted_proba'] < 0.5, sorted_df['Negative_Feature_1'], sorted_df['Positive_Feature_1'])
-        df_display = sorted_df[['animal_id', 'predicted_proba', 'Primary Concern']].rename(columns={'animal_id': 'Pet ID', 'predicted_proba': 'Adoption Probability'}).reset_index(drop=True)
+        df_display = sorted_df[['animal_id', 'predicted_proba', 'adoptability_category', 'Primary Concern']].rename(columns={'animal_id': 'Pet ID', 'predicted_proba': 'Adoption Probability', 'adoptability_category': 'Risk'})
+        df_display['Risk'] = df_display['Risk'].map(RISK_BADGES)
         try:
-            event = st.dataframe(df_display.style.applymap(color_predicted_proba, subset=['Adoption Probability']).format({'Adoption Probability': '{:.2%}'}), use_container_width=True, height=400, hide_index=True, on_select="rerun", selection_mode="single-row")
+            event = st.dataframe(
+                df_display,
+                column_config={
+                    'Adoption Probability': st.column_config.ProgressColumn('Adoption Probability', min_value=0, max_value=1, format='percent'),
+                    'Risk': st.column_config.TextColumn('Risk'),
+                },
+                use_container_width=True, height=400, hide_index=True, on_select="rerun", selection_mode="single-row"
+            )
             if event.selection and len(event.selection.rows) > 0:
                 selected_idx = event.selection.rows[0]
-                selected_animal_id = df_display.iloc[selected_idx]['Pet ID']
-                if st.session_state.selected_animal_id != selected_animal_id:
-                    st.session_state.selected_animal_id = selected_animal_id
-                    st.rerun()
+                selected_animal_id = df_display['Pet ID'].iat[selected_idx]
+                # The selection event already reran the script; the details panel
+                # below renders after this point, so it picks up the new id directly.
+                st.session_state.selected_animal_id = selected_animal_id
         except Exception as e:
-            st.dataframe(df_display.style.applymap(color_predicted_proba, subset=['Adoption Probability']), use_container_width=True, height=300)
+            # Older Streamlit builds without row selection get the Styler-coloured table instead.
+            st.dataframe(df_display.style.apply(color_predicted_proba, subset=['Adoption Probability']), use_container_width=True, height=300)
             if len(df_display) > 0:
                 pet_options = [f"Pet {row['Pet ID']} - Probability: {(row['Adoption Probability'] * 100):.1f}% - {row['Primary Concern']}" for _, row in df_display.iterrows()]
                 selected_option = st.radio("Select a pet:", options=pet_options, index=0)
                 selected_animal_id = int(selected_option.split(" ")[1])
-                if st.session_state.selected_animal_id != selected_animal_id:
-                    st.session_state.selected_animal_id = selected_animal_id
-                    st.rerun()
+                st.session_state.selected_animal_id = selected_animal_id
     with col2:
         st.header("Pet Details")
         if st.session_state.selected_animal_id:
-            pet_rows = sorted_df[sorted_df['animal_id'] == st.session_state.selected_animal_id]
-            if not pet_rows.empty:
-                selected_pet_data = pet_rows.iloc[0]
-                full_detail_html = generate_full_dashboard_html(selected_pet_data)
-                st.components.v1.html(full_detail_html, height=700, scrolling=False)
+            pet_position = find_shown_position(get_pet_positions(df, df.attrs.get('etag')), st.session_state.selected_animal_id, shown_positions)
+            selected_pet_data = None if pet_position is None else sorted_df.iloc[pet_position]
+            if selected_pet_data is not None:
+                if render_details_in_iframe:
+                    full_detail_html = generate_full_dashboard_html(selected_pet_data, column_lookup)
+                    st.components.v1.html(full_detail_html, height=700, scrolling=False)
+                else:
+                    full_detail_html = generate_full_dashboard_html(selected_pet_data, column_lookup, embedded=True)
+                    st.markdown(full_detail_html, unsafe_allow_html=True)
             else:
                 st.info("Selected pet not found in filtered data. Please clear filters or select another pet.")
         else: